@@ -1,37 +1,115 @@
 import os
+import sys
+import socket
 import asyncio
 import logging
+import threading
+import concurrent.futures
 from functions_client import UDPReceiverProtocol
 
 # Configure logging for main.
 logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
 
-async def main():
+# Linux socket option, with its value for Python versions that don't export it (None elsewhere).
+SO_BUSY_POLL = getattr(socket, "SO_BUSY_POLL", 46 if sys.platform.startswith("linux") else None)
+# Several workers need SO_REUSEPORT to share the port and CPU affinity to each own a core;
+# without them (e.g. macOS, Windows) a single unpinned worker is run instead.
+MULTI_WORKER = hasattr(socket, "SO_REUSEPORT") and hasattr(os, "sched_getaffinity") and hasattr(os, "sched_setaffinity")
+# Microseconds a receive may busy-poll the device queue before sleeping.
+BUSY_POLL_USEC = 50
+
+async def receive(listen_ip, listen_port, save_folder, worker_id, cpu, frame_size, pool_buffers, max_frame_size, running):
+    """
+    Run one receiver on the current event loop, sharing the port with the other workers.
+    
+    cpu is None when the platform can't pin threads or share ports; the receiver then runs unpinned.
+    The (loop, task) running the receiver is appended to running so main() can cancel it on shutdown.
+    """
+    running.append((asyncio.get_running_loop(), asyncio.current_task()))
+    if cpu is not None:
+        # Threads inherit the creating thread's CPU mask, so give the executor that saves frames
+        # (asyncio.to_thread) the process-wide mask before pinning; file writes then run off this core.
+        allowed = os.sched_getaffinity(0)
+        asyncio.get_running_loop().set_default_executor(
+            concurrent.futures.ThreadPoolExecutor(initializer=os.sched_setaffinity, initargs=(0, allowed)))
+        # Keep this worker's thread on one core so packets, socket and reassembly share its caches.
+        os.sched_setaffinity(0, {cpu})
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if cpu is not None:
+        # SO_REUSEPORT lets every worker bind the same port; the kernel hashes each flow to one socket.
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    if SO_BUSY_POLL is not None:
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, SO_BUSY_POLL, BUSY_POLL_USEC)
+        except PermissionError:
+            logging.info(f"Busy polling disabled for worker {worker_id} (requires CAP_NET_ADMIN).")
+    sock.bind((listen_ip, listen_port))
+
+    protocol = UDPReceiverProtocol(save_folder, frame_timeout=5.0, worker_id=worker_id,
+                                   frame_size=frame_size, pool_buffers=pool_buffers, max_frame_size=max_frame_size)
+    transport = None
+    try:
+        # Read the socket directly so each wakeup drains a burst of datagrams.
+        protocol.start_reading(sock)
+    except NotImplementedError:
+        # Event loops without add_reader (the Windows proactor) go through a regular transport.
+        transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(lambda: protocol, sock=sock)
+    logging.info(f"UDP client worker {worker_id} listening on {listen_ip}:{listen_port} (CPU {'any' if cpu is None else cpu}).")
+
+    try:
+        # Run indefinitely.
+        await asyncio.sleep(3600 * 24)
+    except asyncio.CancelledError:
+        pass
+    finally:
+        if transport is not None:
+            transport.close()
+        else:
+            protocol.stop_reading()
+            sock.close()
+
+def main():
     # Define the local IP and port to bind for receiving UDP packets.
     listen_ip = "0.0.0.0"
     listen_port = 5005
 
+    # Expected frame size and number of frames each worker handles at once, used to size its buffer pool.
+    frame_size = 4 * 1024 * 1024
+    pool_buffers = 2
+    # Largest frame accepted in bytes; None accepts any frame the header can describe.
+    max_frame_size = None
+
+    # One receiver per CPU core available to the process, each with its own socket and event loop thread.
+    cpus = sorted(os.sched_getaffinity(0)) if MULTI_WORKER else [None]
+
     # Define the folder where received PLY files will be saved.
     save_folder = "received_folder"
     if not os.path.exists(save_folder):
         os.makedirs(save_folder)
         logging.info(f"Created folder '{save_folder}' for saving received files.")
 
-    loop = asyncio.get_running_loop()
-    # Create a UDP endpoint and bind it to the local address.
-    transport, protocol = await loop.create_datagram_endpoint(
-        lambda: UDPReceiverProtocol(save_folder, frame_timeout=5.0),
-        local_addr=(listen_ip, listen_port)
-    )
-    logging.info(f"UDP client listening on {listen_ip}:{listen_port}.")
-
+    # (loop, task) of each running receiver, filled in by the workers.
+    running = []
+    workers = [
+        threading.Thread(target=asyncio.run, args=(receive(listen_ip, listen_port, save_folder, worker_id, cpu, frame_size, pool_buffers, max_frame_size, running),), daemon=True)
+        for worker_id, cpu in enumerate(cpus)
+    ]
+    for worker in workers:
+        worker.start()
     try:
-        # Run indefinitely.
-        await asyncio.sleep(3600 * 24)
-    except asyncio.CancelledError:
-        pass
-    finally:
-        transport.close()
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        # Cancel each receiver on its own loop; asyncio.run then waits for frames still being written.
+        logging.info("Shutting down UDP client workers...")
+        for loop, task in running:
+            try:
+                loop.call_soon_threadsafe(task.cancel)
+            except RuntimeError:
+                pass  # The worker already exited and closed its loop.
+        for worker in workers:
+            worker.join()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    main()
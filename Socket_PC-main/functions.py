@@ -1,9 +1,18 @@
 import os
+import errno
 import glob
-import math
+import mmap
+import struct
+import socket
 import asyncio
 import time
 import logging
+import functools
+
+try:
+    from asyncinotify import Inotify, Mask
+except ImportError:  # Optional (Linux only); monitor_folder_and_send falls back to polling.
+    Inotify = None
 
 # Configure logging to output to the console only.
 logger = logging.getLogger("AsyncUDPSender")
@@ -13,15 +22,131 @@ formatter = logging.Formatter('[%(asctime)s] %(levelname)s: %(message)s')
 handler.setFormatter(formatter)
 logger.addHandler(handler)
 
+# Packet header: frame counter (4 bytes), total chunks (2 bytes), chunk index (2 bytes).
+_HDR = struct.Struct('>IHH')
+# The frame counter and total chunks are fixed for a frame; only the chunk index changes per packet.
+_HDR_FRAME = struct.Struct('>IH')
+_HDR_CHUNK = struct.Struct('>H')
+
+# Requested socket send buffer size; the kernel caps it at net.core.wmem_max.
+SOCKET_BUFFER_SIZE = 4 * 1024 * 1024
+
+# Linux UDP generic segmentation offload: one sendmsg carries several equal-size
+# datagrams (only the last may be shorter) that the kernel splits back apart.
+_UDP_SEGMENT = getattr(socket, "UDP_SEGMENT", 103)
+_UDP_MAX_SEGMENTS = 64
+_MAX_UDP_PAYLOAD = 65507
+_GSO_SIZE = struct.Struct('=H')
+# The kernel rejects GSO sends whose segments don't fit the route MTU, so GSO is only used when
+# the IP + UDP headers plus segment_size fit it; by default (chunk_size 8000) that is only loopback
+# or jumbo-frame links. Socket options with their Linux values, for Pythons that don't export them.
+_IP_MTU = getattr(socket, "IP_MTU", 14)
+_IPV6_MTU = getattr(socket, "IPV6_MTU", 24)
+_IP_UDP_OVERHEAD = {socket.AF_INET: 20 + 8, socket.AF_INET6: 40 + 8}
+# Errors meaning the GSO send itself is unsupported, as opposed to the destination or route failing.
+_GSO_ERRNOS = frozenset((errno.EINVAL, errno.EMSGSIZE, errno.EIO, errno.ENOPROTOOPT))
+
 class UDPSenderProtocol(asyncio.DatagramProtocol):
     def connection_made(self, transport):
         self.transport = transport
+        # The transport only exposes a restricted socket wrapper; keep a duplicate of
+        # the underlying socket so send_file can call sendmsg on it directly.
+        self.sock = socket.socket(fileno=os.dup(transport.get_extra_info('socket').fileno()))
+        self.sock.setblocking(False)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+        # Probe for UDP GSO support (Linux 4.18+); a gso_size of 0 leaves sends unchanged.
+        try:
+            self.sock.setsockopt(socket.SOL_UDP, _UDP_SEGMENT, 0)
+            self.gso = True
+        except OSError:
+            self.gso = False
+        # Route MTU per destination, filled in by _gso_fits.
+        self.path_mtu = {}
         logger.info("UDP connection established.")
 
     def error_received(self, exc):
         logger.error("Error received: %s", exc)
 
-async def send_file(filepath, transport, target_addr, frame_counter, chunk_size=8000, fps=30):
+    def connection_lost(self, exc):
+        self.sock.close()
+
+def _send_packet(protocol, buffers, target_addr):
+    """
+    Send one datagram gathered from buffers, deferring to the transport if the socket is busy.
+    
+    Once the transport holds queued datagrams, later ones are queued behind them rather
+    than sent directly, so packets are never reordered. Other send errors are reported to protocol.error_received and the packet is dropped,
+    as the asyncio transport does, so one failed send does not abort the whole file.
+    """
+    transport = protocol.transport
+    if transport.get_write_buffer_size():
+        transport.sendto(b"".join(buffers), target_addr)
+        return
+    try:
+        protocol.sock.sendmsg(buffers, (), 0, target_addr)
+    except (BlockingIOError, InterruptedError):
+        transport.sendto(b"".join(buffers), target_addr)
+    except OSError as exc:
+        protocol.error_received(exc)
+
+def _gso_fits(protocol, segment_size, target_addr):
+    """Return True if GSO is available and datagrams of segment_size bytes fit the route MTU to target_addr."""
+    if not protocol.gso:
+        return False
+    family = protocol.sock.family
+    mtu = protocol.path_mtu.get(target_addr)
+    if mtu is None:
+        # Connecting a throwaway socket looks up the route without sending anything.
+        try:
+            with socket.socket(family, socket.SOCK_DGRAM) as probe:
+                probe.connect(target_addr)
+                if family == socket.AF_INET6:
+                    mtu = probe.getsockopt(socket.IPPROTO_IPV6, _IPV6_MTU)
+                else:
+                    mtu = probe.getsockopt(socket.IPPROTO_IP, _IP_MTU)
+        except OSError:
+            mtu = 0
+        protocol.path_mtu[target_addr] = mtu
+    return segment_size + _IP_UDP_OVERHEAD.get(family, 48) <= mtu
+
+@functools.lru_cache(maxsize=None)
+def _gso_params(segment_size):
+    """Return (buffers per GSO send, sendmsg ancillary data) for datagrams of segment_size bytes."""
+    group_len = 2 * min(_UDP_MAX_SEGMENTS, _MAX_UDP_PAYLOAD // segment_size)
+    return group_len, [(socket.SOL_UDP, _UDP_SEGMENT, _GSO_SIZE.pack(segment_size))]
+
+def _send_batch(protocol, buffers, segment_size, target_addr, gso):
+    """
+    Send the datagrams whose (header, payload) pairs are flattened in buffers.
+    
+    With UDP GSO (gso, as checked by _gso_fits), up to 64 KB worth of datagrams go out per
+    sendmsg and the kernel splits them at segment_size; every payload but the last must
+    therefore be full.
+    If the kernel or NIC rejects the GSO send itself, GSO is turned off for the protocol
+    and packets are sent one by one from then on. Any other send error is reported to
+    protocol.error_received and the group is dropped, as _send_packet does.
+    """
+    sock = protocol.sock
+    group_len, gso_control = _gso_params(segment_size)
+    for group_start in range(0, len(buffers), group_len):
+        group = buffers[group_start:group_start + group_len]
+        # GSO bypasses the transport, so only use it while nothing is queued there.
+        if gso and protocol.gso and len(group) > 2 and not protocol.transport.get_write_buffer_size():
+            try:
+                sock.sendmsg(group, gso_control, 0, target_addr)
+                continue
+            except (BlockingIOError, InterruptedError):
+                pass
+            except OSError as e:
+                if e.errno not in _GSO_ERRNOS:
+                    protocol.error_received(e)
+                    continue
+                logger.warning("UDP GSO send failed (%s); sending packets individually.", e)
+                protocol.gso = False
+        for i in range(0, len(group), 2):
+            _send_packet(protocol, group[i:i + 2], target_addr)
+
+async def send_file(filepath, transport, target_addr, frame_counter, chunk_size=8000, fps=30, batch_size=8, use_mmap=True):
     """
     Reads a PLY file and sends it via UDP in chunks with a custom header.
     
@@ -34,58 +159,112 @@ async def send_file(filepath, transport, target_addr, frame_counter, chunk_size=
     :param transport:  An open asyncio UDP transport.
     :param target_addr: Tuple (IP, port) for the destination.
     :param frame_counter: Current frame counter (will be updated).
-    :param chunk_size:  Maximum payload size per UDP packet (excluding header).
+    :param chunk_size:  Maximum payload size per UDP packet (excluding header). UDP GSO is
+                        only used when chunk_size fits the route MTU minus 36 bytes (IPv4).
     :param fps:         Throttle sending between chunks (frames per second).
+    :param batch_size:  Number of chunks sent back-to-back before yielding to the event loop.
+    :param use_mmap:    Map the file instead of reading a snapshot of it. Only safe once the
+                        producer has finished writing: truncating a mapped file raises SIGBUS.
     :return: Updated frame counter.
     """
     try:
         with open(filepath, "rb") as f:
-            file_data = f.read()
+            if use_mmap:
+                # Map the file rather than reading it so chunks are sliced straight out of the page cache.
+                file_data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                file_data = f.read()
     except Exception as e:
         logger.error(f"Error reading file '{filepath}': {e}")
         return frame_counter
 
     frame_size = len(file_data)
-    logger.info(f"Sending file '{os.path.basename(filepath)}' ({frame_size} bytes) as frame #{frame_counter}.")
+    logger.info("Sending file '%s' (%d bytes) as frame #%d.", os.path.basename(filepath), frame_size, frame_counter)
 
-    frame_counter_bytes = frame_counter.to_bytes(4, 'big', signed=False)
-    total_chunks = math.ceil(frame_size / chunk_size)
-    total_chunks_bytes = total_chunks.to_bytes(2, 'big', signed=False)
+    total_chunks = (frame_size + chunk_size - 1) // chunk_size
     delay = 1.0 / fps
 
-    for chunk_idx in range(total_chunks):
-        start = chunk_idx * chunk_size
-        end = min(start + chunk_size, frame_size)
-        chunk_data = file_data[start:end]
-        chunk_idx_bytes = chunk_idx.to_bytes(2, 'big', signed=False)
-        payload = frame_counter_bytes + total_chunks_bytes + chunk_idx_bytes + chunk_data
-        transport.sendto(payload, target_addr)
-        await asyncio.sleep(delay)
-        
-    logger.info(f"Finished sending file '{os.path.basename(filepath)}' as frame #{frame_counter}.")
+    # Headers and payloads are gathered by sendmsg, so nothing is concatenated per chunk.
+    # Each chunk of a batch needs its own header buffer since they are sent together.
+    headers = [bytearray(_HDR.size) for _ in range(batch_size)]
+    for header in headers:
+        _HDR_FRAME.pack_into(header, 0, frame_counter, total_chunks)
+    chunk_idx_offset = _HDR_FRAME.size
+    segment_size = _HDR.size + chunk_size
+    file_view = memoryview(file_data)
+
+    protocol = transport.get_protocol()
+    gso = _gso_fits(protocol, segment_size, target_addr)
+    buffers = []
+
+    try:
+        # Send chunks in bursts and sleep once per burst, keeping the same average rate.
+        for batch_start in range(0, total_chunks, batch_size):
+            batch_end = min(batch_start + batch_size, total_chunks)
+            buffers.clear()
+            for chunk_idx in range(batch_start, batch_end):
+                start = chunk_idx * chunk_size
+                header = headers[chunk_idx - batch_start]
+                _HDR_CHUNK.pack_into(header, chunk_idx_offset, chunk_idx)
+                buffers += (header, file_view[start:start + chunk_size])
+            _send_batch(protocol, buffers, segment_size, target_addr, gso)
+            await asyncio.sleep(delay * (batch_end - batch_start))
+    finally:
+        buffers.clear()
+        file_view.release()
+        if use_mmap:
+            try:
+                file_data.close()
+            except BufferError:
+                # Chunk views are still referenced by the traceback of the exception being
+                # raised; the mapping is closed when they are collected. Don't mask that error.
+                pass
+
+    logger.info("Finished sending file '%s' as frame #%d.", os.path.basename(filepath), frame_counter)
     return (frame_counter + 1) % (2**32)
 
-async def monitor_folder_and_send(send_folder, transport, target_addr, chunk_size=8000, fps=30, poll_interval=1.0, clear_interval=120):
+async def monitor_folder_and_send(send_folder, transport, target_addr, chunk_size=8000, fps=30, poll_interval=1.0, clear_interval=120, use_mmap=False):
     """
     Monitors a folder for new .ply files and sends each new file via UDP.
     
-    The function tracks sent files in a set to avoid re-sending. To prevent unbounded
-    memory growth during long-term operation, the sent files set is cleared every
-    `clear_interval` seconds.
+    When asyncinotify is installed the folder is watched with inotify: files already
+    present are sent once at startup, then each .ply file written or moved into the
+    folder is sent as soon as it is closed, with no polling in between.
+    
+    Otherwise the folder is polled and sent files are tracked in a set to avoid
+    re-sending. To prevent unbounded memory growth during long-term operation, the
+    sent files set is cleared every `clear_interval` seconds.
     
     :param send_folder:  Folder to monitor for .ply files.
     :param transport:    An open asyncio UDP transport.
     :param target_addr:  Tuple (IP, port) for the destination.
     :param chunk_size:   Maximum payload size per UDP packet (excluding header).
     :param fps:          Frames per second (controls inter-chunk delay).
-    :param poll_interval:Time interval (seconds) between folder polls.
-    :param clear_interval:Time interval (seconds) to clear the sent files set.
+    :param poll_interval:Time interval (seconds) between folder polls (polling only).
+    :param clear_interval:Time interval (seconds) to clear the sent files set (polling only).
+    :param use_mmap:     Send files from a memory mapping instead of an in-memory snapshot. Sending
+                         is paced over seconds, so only enable this if producers never rewrite or
+                         truncate a file once written: that kills the sender with SIGBUS.
     """
-    sent_files = set()
     frame_counter = 0
-    last_clear_time = time.time()
     logger.info(f"Started monitoring folder '{send_folder}' for new .ply files...")
 
+    if Inotify is not None:
+        with Inotify() as inotify:
+            # Add the watch before listing so no file can slip in between the two.
+            inotify.add_watch(send_folder, Mask.CLOSE_WRITE | Mask.MOVED_TO)
+            for filepath in sorted(glob.glob(os.path.join(send_folder, "*.ply"))):
+                logger.info("Existing file detected: '%s'", filepath)
+                # The file may still be being written, so send a snapshot rather than a mapping.
+                frame_counter = await send_file(filepath, transport, target_addr, frame_counter, chunk_size, fps, use_mmap=False)
+            async for event in inotify:
+                if event.path is not None and event.path.suffix == ".ply":
+                    logger.info("New file detected: '%s'", event.path)
+                    frame_counter = await send_file(str(event.path), transport, target_addr, frame_counter, chunk_size, fps, use_mmap=use_mmap)
+
+    sent_files = set()
+    last_clear_time = time.time()
+
     while True:
         now = time.time()
         if now - last_clear_time >= clear_interval:
@@ -96,7 +275,9 @@ async def monitor_folder_and_send(send_folder, transport, target_addr, chunk_siz
         ply_files = sorted(glob.glob(os.path.join(send_folder, "*.ply")))
         for filepath in ply_files:
             if filepath not in sent_files:
-                logger.info(f"New file detected: '{filepath}'")
-                frame_counter = await send_file(filepath, transport, target_addr, frame_counter, chunk_size, fps)
+                logger.info("New file detected: '%s'", filepath)
+                # Polling can pick a file up while its producer is still writing it, so
+                # send a snapshot rather than a mapping that a truncation would turn into SIGBUS.
+                frame_counter = await send_file(filepath, transport, target_addr, frame_counter, chunk_size, fps, use_mmap=False)
                 sent_files.add(filepath)
         await asyncio.sleep(poll_interval)
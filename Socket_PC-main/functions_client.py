@@ -1,5 +1,9 @@
 import os
 import time
+import heapq
+import struct
+import collections
+import socket
 import asyncio
 import logging
 
@@ -11,94 +15,351 @@ formatter = logging.Formatter('[%(asctime)s] %(levelname)s: %(message)s')
 handler.setFormatter(formatter)
 logger.addHandler(handler)
 
+# Packet header: frame counter (4 bytes), total chunks (2 bytes), chunk index (2 bytes).
+_HDR = struct.Struct('>IHH')
+_HDR_SIZE = _HDR.size
+_unpack_header = _HDR.unpack_from
+
+# Number of frames that can be reassembled at once (must be a power of two).
+MAX_IN_FLIGHT_FRAMES = 64
+
+# Requested socket receive buffer size; the kernel caps it at net.core.rmem_max.
+SOCKET_BUFFER_SIZE = 4 * 1024 * 1024
+
+# Default number of pooled frame buffers: frames being reassembled or saved at the same time.
+FRAME_POOL_BUFFERS = 4
+# Default expected frame size; frames up to this size are reassembled in pooled buffers.
+FRAME_SIZE = 4 * 1024 * 1024
+# Largest frame accepted in bytes; None accepts any frame the header can describe (MAX_CHUNKS chunks).
+MAX_FRAME_SIZE = None
+MAX_CHUNKS = 0xFFFF
+
+# Minimum interval in seconds between per-packet warnings of one kind, so bad traffic cannot flood the log.
+WARNING_INTERVAL = 1.0
+
+# Maximum number of datagrams read per readable event when reading the socket directly.
+RECV_BATCH = 64
+# Largest possible UDP payload, so the receive buffer never truncates a datagram.
+MAX_DATAGRAM_SIZE = 65535
+
+def _write_file(filepath, data):
+    """Write data to filepath (blocking; run via asyncio.to_thread)."""
+    with open(filepath, "wb") as f:
+        f.write(data)
+
+class BufPool:
+    """
+    Up to n equal-size frame buffers reused across frames instead of allocating one per frame.
+    
+    Buffers are allocated on first use, so an idle receiver does not hold n * size bytes.
+    """
+    def __init__(self, n, size):
+        """
+        :param n: Maximum number of buffers kept in the pool.
+        :param size: Size in bytes of each buffer (the largest frame it can hold).
+        """
+        self.n = n
+        self.size = size
+        self.q = collections.deque()
+        self.allocated = 0
+        self.misses = 0
+
+    def get(self, size):
+        """
+        Return (buffer, missed): a buffer of at least size bytes, and whether it had to be
+        allocated outside the pool because none was free or size exceeds the pooled size.
+        """
+        if size <= self.size:
+            if self.q:
+                return self.q.popleft(), False
+            if self.allocated < self.n:
+                self.allocated += 1
+                return bytearray(self.size), False
+        self.misses += 1
+        return bytearray(size), True
+
+    def put(self, buf):
+        """Return a buffer to the pool; buffers not allocated by the pool are dropped."""
+        if len(buf) == self.size and isinstance(buf, bytearray) and len(self.q) < self.n:
+            self.q.append(buf)
+
+class FrameSlot:
+    """
+    Reassembly state for one in-flight frame.
+    
+    Frames that fit a pooled buffer have their chunks written straight into buf at their
+    offset. Larger frames keep each chunk in chunks until complete, so memory grows with
+    the data actually received rather than with the size a (possibly spoofed) header claims.
+    """
+    def __init__(self, pool):
+        self.pool = pool
+        self.frame_counter = None  # None while the slot is free.
+        self.total_chunks = 0
+        self.received = 0
+        self.payload_size = 0
+        self.last_update = 0.0
+        self.buf = None
+        self.chunks = None  # Payloads by chunk index, for frames too large for a pooled buffer.
+        self.bitmap = bytearray()  # One bit per chunk index already received.
+
+    def reset(self, frame_counter, total_chunks, chunk_size, now):
+        """Start reassembling a new frame in this slot; returns True if its buffer missed the pool."""
+        if self.buf is not None:
+            self.pool.put(self.buf)
+        self.frame_counter = frame_counter
+        self.total_chunks = total_chunks
+        self.received = 0
+        self.payload_size = 0
+        self.last_update = now
+        self.bitmap = bytearray((total_chunks + 7) // 8)
+        size = total_chunks * chunk_size
+        if size > self.pool.size:
+            self.buf, self.chunks = None, {}
+            return False
+        self.buf, missed = self.pool.get(size)
+        self.chunks = None
+        return missed
+
+    def release(self):
+        """Mark the slot free and return its frame buffer to the pool."""
+        self.frame_counter = None
+        self.chunks = None
+        if self.buf is not None:
+            self.pool.put(self.buf)
+            self.buf = None
+
+    def detach(self):
+        """Mark the slot free and hand its frame buffer to the caller, who must return it to the pool."""
+        buf = self.buf
+        if buf is None:
+            buf = b"".join([self.chunks[i] for i in range(self.total_chunks)])
+        self.frame_counter = None
+        self.buf = None
+        self.chunks = None
+        return buf
+
 class UDPReceiverProtocol(asyncio.DatagramProtocol):
-    def __init__(self, save_folder, frame_timeout=5.0):
+    def __init__(self, save_folder, frame_timeout=5.0, chunk_size=8000, worker_id=None, pool=None, max_frame_size=MAX_FRAME_SIZE,
+                 frame_size=FRAME_SIZE, pool_buffers=FRAME_POOL_BUFFERS):
         """
         :param save_folder: Folder where complete PLY files will be saved.
         :param frame_timeout: Timeout in seconds for discarding incomplete frames.
+        :param chunk_size: Payload size per UDP packet used by the sender (excluding header).
+        :param worker_id: Receiver index when several share a port and save folder; added to file names.
+        :param pool: BufPool supplying frame buffers (defaults to a new pool built from frame_size and pool_buffers).
+        :param max_frame_size: Largest frame in bytes (total_chunks * chunk_size) that will be reassembled;
+                               None accepts any frame the header can describe.
+        :param frame_size: Expected frame size in bytes; pooled buffers hold frames up to this size.
+                           Larger frames are assembled from their chunks once complete.
+        :param pool_buffers: Number of frames expected to be reassembled or saved at the same time.
         """
         self.save_folder = save_folder
+        self.worker_id = worker_id
         self.frame_timeout = frame_timeout
-        self.reassembly_dict = {}  # { frame_counter: { "total_chunks": int, "chunks": list, "received_count": int, "last_update": float } }
+        self.chunk_size = chunk_size
+        self.max_frame_size = max_frame_size if max_frame_size is not None else MAX_CHUNKS * chunk_size
+        # Frame counter of the last frame dropped for exceeding max_frame_size, so it is logged once.
+        self.rejected_frame = None
+        if pool is None:
+            # Round up to whole chunks, since a frame's buffer is sized as total_chunks * chunk_size.
+            frame_size = min(frame_size, self.max_frame_size)
+            pool = BufPool(pool_buffers, -(-frame_size // chunk_size) * chunk_size)
+        self.pool = pool
+        # Ring of reassembly slots indexed by the low bits of the frame counter.
+        self.slots = [FrameSlot(self.pool) for _ in range(MAX_IN_FLIGHT_FRAMES)]
+        # Min-heap of (deadline, frame_counter); entries for finished frames are skipped lazily.
+        self.expiry = []
+        # Scratch buffer for start_reading(); each datagram is copied out of it before the next read.
+        self.recv_buf = bytearray(MAX_DATAGRAM_SIZE)
+        self.recv_view = memoryview(self.recv_buf)
+        self.sock = None
+        # Per warning message: [time last logged, number suppressed since, args of the latest one].
+        self.warnings = {}
         self.loop = asyncio.get_running_loop()
         self.cleanup_task = self.loop.create_task(self.cleanup_loop())
 
+    def connection_made(self, transport):
+        # A larger receive buffer absorbs the sender's bursts while a frame is being saved.
+        transport.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+
+    def start_reading(self, sock):
+        """
+        Read datagrams from a bound UDP socket without an asyncio transport.
+        
+        The transport reads one datagram per readable event; here each event drains up
+        to RECV_BATCH datagrams into a preallocated buffer, so no per-packet bytes
+        objects are created.
+        """
+        self.sock = sock
+        sock.setblocking(False)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+        self.loop.add_reader(sock.fileno(), self._drain)
+
+    def stop_reading(self):
+        """Stop reading the socket passed to start_reading() and shut down the protocol."""
+        self.loop.remove_reader(self.sock.fileno())
+        self.connection_lost(None)
+
+    def _drain(self):
+        recvfrom_into = self.sock.recvfrom_into
+        recv_buf, recv_view = self.recv_buf, self.recv_view
+        for _ in range(RECV_BATCH):
+            try:
+                nbytes, addr = recvfrom_into(recv_buf)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as exc:
+                logger.error("Error receiving datagram: %s", exc)
+                return
+            # The payload is copied straight from the scratch buffer into the frame buffer;
+            # releasing the view makes any reference kept past this call fail loudly
+            # instead of silently seeing the next datagram.
+            with recv_view[:nbytes] as packet:
+                self.datagram_received(packet, addr)
+
+    def _warn(self, msg, *args):
+        """
+        Log a per-packet warning at most once per WARNING_INTERVAL for each message, counting
+        the ones dropped; cleanup_loop reports counts that no later warning picked up.
+        """
+        now = self.loop.time()
+        state = self.warnings.get(msg)
+        if state is None:
+            self.warnings[msg] = [now, 0, args]
+        elif now - state[0] < WARNING_INTERVAL:
+            state[1] += 1
+            state[2] = args
+            return
+        else:
+            if state[1]:
+                msg += " (%d similar warnings suppressed)"
+                args += (state[1],)
+            state[:] = now, 0, ()
+        logger.warning(msg, *args)
+
+    def _flush_warnings(self, now):
+        """Report warnings suppressed for a full WARNING_INTERVAL, repeating the latest of each kind."""
+        for msg, state in self.warnings.items():
+            if state[1] and now - state[0] >= WARNING_INTERVAL:
+                logger.warning(msg + " (latest of %d suppressed warnings)", *state[2], state[1])
+                state[:] = now, 0, ()
+
     def datagram_received(self, data, addr):
         # Expecting at least 8 bytes for custom header.
-        if len(data) < 8:
-            logger.warning(f"Received packet too small ({len(data)} bytes) from {addr}. Ignoring.")
+        chunk_len = len(data) - _HDR_SIZE
+        if chunk_len < 0:
+            self._warn("Received packet too small (%d bytes) from %s. Ignoring.", len(data), addr)
             return
 
         # Parse custom header:
         # - First 4 bytes: frame counter (big-endian unsigned int)
         # - Next 2 bytes: total chunks (big-endian unsigned int)
         # - Next 2 bytes: chunk index (big-endian unsigned int)
-        frame_counter = int.from_bytes(data[0:4], "big", signed=False)
-        total_chunks = int.from_bytes(data[4:6], "big", signed=False)
-        chunk_idx = int.from_bytes(data[6:8], "big", signed=False)
-        chunk_data = data[8:]
+        frame_counter, total_chunks, chunk_idx = _unpack_header(data)
 
         if total_chunks <= 0 or chunk_idx >= total_chunks:
-            logger.warning(f"Invalid header from {addr} (chunk {chunk_idx} of {total_chunks}). Skipping packet.")
+            self._warn("Invalid header from %s (chunk %d of %d). Skipping packet.", addr, chunk_idx, total_chunks)
+            return
+
+        # Every chunk but the last must be exactly chunk_size, or chunks would land at the
+        # wrong offsets (e.g. a sender using a different chunk size) and corrupt the frame.
+        chunk_size = self.chunk_size
+        if chunk_len != chunk_size and (chunk_len > chunk_size or chunk_idx != total_chunks - 1):
+            self._warn("Chunk %d of %d from %s is %d bytes, expected %d. Skipping packet.", chunk_idx, total_chunks, addr, chunk_len, chunk_size)
             return
 
         now = self.loop.time()
 
-        # Initialize reassembly for this frame if not present.
-        if frame_counter not in self.reassembly_dict:
-            self.reassembly_dict[frame_counter] = {
-                "total_chunks": total_chunks,
-                "chunks": [None] * total_chunks,
-                "received_count": 0,
-                "last_update": now,
-            }
-
-        frame_info = self.reassembly_dict[frame_counter]
-
-        # Update total_chunks if needed (rare case).
-        if frame_info["total_chunks"] != total_chunks:
-            logger.warning(f"Frame {frame_counter}: total_chunks mismatch. Updating.")
-            frame_info["total_chunks"] = total_chunks
-            frame_info["chunks"] = [None] * total_chunks
-            frame_info["received_count"] = 0
-
-        # Save the chunk if not already present.
-        if frame_info["chunks"][chunk_idx] is None:
-            frame_info["chunks"][chunk_idx] = chunk_data
-            frame_info["received_count"] += 1
-            frame_info["last_update"] = now
+        # Claim the slot for this frame, evicting whatever stale frame still holds it.
+        slot = self.slots[frame_counter & (MAX_IN_FLIGHT_FRAMES - 1)]
+        if slot.frame_counter != frame_counter or slot.total_chunks != total_chunks:
+            if total_chunks * chunk_size > self.max_frame_size:
+                if frame_counter != self.rejected_frame:
+                    self.rejected_frame = frame_counter
+                    logger.warning("Dropping frame #%d from %s: %d chunks exceed the %d byte frame limit.",
+                                   frame_counter, addr, total_chunks, self.max_frame_size)
+                return
+            if slot.frame_counter == frame_counter:
+                # Update total_chunks if needed (rare case).
+                self._warn("Frame %d: total_chunks mismatch. Updating.", frame_counter)
+            elif slot.frame_counter is not None:
+                self._warn("Evicting incomplete frame #%d: received %d/%d chunks.", slot.frame_counter, slot.received, slot.total_chunks)
+            if slot.reset(frame_counter, total_chunks, chunk_size, now):
+                # Misses are expected while more frames than pool_buffers are in flight; pool.misses counts them.
+                logger.debug("Frame buffer pool miss #%d: allocating %d bytes.", self.pool.misses, total_chunks * chunk_size)
+            heapq.heappush(self.expiry, (now + self.frame_timeout, frame_counter))
+
+        # Drop duplicate chunks.
+        bitmap = slot.bitmap
+        byte_idx, mask = chunk_idx >> 3, 1 << (chunk_idx & 7)
+        if bitmap[byte_idx] & mask:
+            return
+        bitmap[byte_idx] |= mask
+
+        # A view avoids copying the payload before it is written into the frame buffer.
+        offset = chunk_idx * chunk_size
+        if slot.buf is not None:
+            slot.buf[offset:offset + chunk_len] = memoryview(data)[_HDR_SIZE:]
+        else:
+            slot.chunks[chunk_idx] = bytes(memoryview(data)[_HDR_SIZE:])
+        if chunk_idx == total_chunks - 1:
+            slot.payload_size = offset + chunk_len
+        slot.received += 1
+        slot.last_update = now
 
         # Check if frame is complete.
-        if frame_info["received_count"] == frame_info["total_chunks"]:
-            complete_frame = b"".join(frame_info["chunks"])
+        if slot.received == total_chunks:
+            # Hand over a view of the frame buffer itself; save_frame returns it to the pool.
+            complete_frame = memoryview(slot.detach())[:slot.payload_size]
             # Schedule saving the complete frame asynchronously.
             self.loop.create_task(self.save_frame(frame_counter, complete_frame))
-            # Remove frame from reassembly dictionary.
-            del self.reassembly_dict[frame_counter]
 
     async def save_frame(self, frame_counter, data):
         """Save the complete PLY file to the designated folder."""
-        filename = f"frame_{frame_counter}_{int(time.time())}.ply"
+        if self.worker_id is None:
+            filename = f"frame_{frame_counter}_{int(time.time())}.ply"
+        else:
+            filename = f"frame_{frame_counter}_{int(time.time())}_w{self.worker_id}.ply"
         filepath = os.path.join(self.save_folder, filename)
         try:
-            with open(filepath, "wb") as f:
-                f.write(data)
-            logger.info(f"Saved complete frame #{frame_counter} to '{filepath}'.")
+            # Write from a worker thread so the event loop keeps receiving packets.
+            await asyncio.to_thread(_write_file, filepath, data)
+            logger.info("Saved complete frame #%d to '%s'.", frame_counter, filepath)
         except Exception as e:
             logger.error(f"Error saving frame #{frame_counter} to '{filepath}': {e}")
+        finally:
+            # The frame was written straight from a pool buffer; it can be reused now.
+            self.pool.put(data.obj)
 
     async def cleanup_loop(self):
-        """Periodically remove incomplete frames that have timed out."""
+        """
+        Remove incomplete frames that have timed out, sleeping until the earliest deadline,
+        and report suppressed warnings at least once per WARNING_INTERVAL.
+        """
         while True:
             now = self.loop.time()
-            to_remove = []
-            for fc, info in self.reassembly_dict.items():
-                if now - info["last_update"] > self.frame_timeout:
-                    logger.warning(f"Discarding incomplete frame #{fc}: received {info['received_count']}/{info['total_chunks']} chunks.")
-                    to_remove.append(fc)
-            for fc in to_remove:
-                del self.reassembly_dict[fc]
-            await asyncio.sleep(1)
+            self._flush_warnings(now)
+            if not self.expiry:
+                await asyncio.sleep(min(self.frame_timeout, WARNING_INTERVAL))
+                continue
+            deadline, fc = self.expiry[0]
+            delay = deadline - now
+            if delay > 0:
+                await asyncio.sleep(min(delay, WARNING_INTERVAL))
+                continue
+            heapq.heappop(self.expiry)
+
+            slot = self.slots[fc & (MAX_IN_FLIGHT_FRAMES - 1)]
+            if slot.frame_counter != fc:
+                # Frame already completed or evicted.
+                continue
+            deadline = slot.last_update + self.frame_timeout
+            if deadline > self.loop.time():
+                # Chunks arrived since this entry was pushed; check again later.
+                heapq.heappush(self.expiry, (deadline, fc))
+            else:
+                logger.warning("Discarding incomplete frame #%d: received %d/%d chunks.", fc, slot.received, slot.total_chunks)
+                slot.release()
 
     def connection_lost(self, exc):
         if exc: